@@ -3,6 +3,13 @@
 #-------------------------------------------------------------------------------
 import json, sys, subprocess
 
+# use orjson to parse the (large) clang AST dump if it's installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 def is_api_decl(decl, prefix):
     if 'name' in decl:
         return decl['name'].startswith(prefix)
@@ -24,20 +31,22 @@ def dep_prefix(decl, dep_prefixes):
             return prefix
     return None
 
+# NOTE: type and name strings are interned, the generators compare them
+# against each other and use them as dict/set keys a lot
 def filter_types(str):
-    return str.replace('_Bool', 'bool')
+    return sys.intern(str.replace('_Bool', 'bool'))
 
 def parse_struct(decl):
     outp = {}
     outp['kind'] = 'struct'
-    outp['name'] = decl['name']
+    outp['name'] = sys.intern(decl['name'])
     outp['fields'] = []
     for item_decl in decl['inner']:
         if item_decl['kind'] != 'FieldDecl':
             sys.exit(f"ERROR: Structs must only contain simple fields ({decl['name']})")
         item = {}
         if 'name' in item_decl:
-            item['name'] = item_decl['name']
+            item['name'] = sys.intern(item_decl['name'])
         item['type'] = filter_types(item_decl['type']['qualType'])
         outp['fields'].append(item)
     return outp
@@ -46,7 +55,7 @@ def parse_enum(decl):
     outp = {}
     if 'name' in decl:
         outp['kind'] = 'enum'
-        outp['name'] = decl['name']
+        outp['name'] = sys.intern(decl['name'])
         needs_value = False
     else:
         outp['kind'] = 'consts'
@@ -55,7 +64,7 @@ def parse_enum(decl):
     for item_decl in decl['inner']:
         if item_decl['kind'] == 'EnumConstantDecl':
             item = {}
-            item['name'] = item_decl['name']
+            item['name'] = sys.intern(item_decl['name'])
             if 'inner' in item_decl:
                 const_expr = item_decl['inner'][0]
                 if const_expr['kind'] != 'ConstantExpr':
@@ -73,7 +82,7 @@ def parse_enum(decl):
 def parse_func(decl):
     outp = {}
     outp['kind'] = 'func'
-    outp['name'] = decl['name']
+    outp['name'] = sys.intern(decl['name'])
     outp['type'] = filter_types(decl['type']['qualType'])
     outp['params'] = []
     if 'inner' in decl:
@@ -82,7 +91,7 @@ def parse_func(decl):
                 print(f"warning: ignoring func {decl['name']} (unsupported parameter type)")
                 return None
             outp_param = {}
-            outp_param['name'] = param['name']
+            outp_param['name'] = sys.intern(param['name'])
             outp_param['type'] = filter_types(param['type']['qualType'])
             outp['params'].append(outp_param)
     return outp
@@ -105,7 +114,7 @@ def clang(csrc_path):
 
 def gen(header_path, source_path, module, main_prefix, dep_prefixes):
     ast = clang(source_path)
-    inp = json.loads(ast)
+    inp = json_loads(ast)
     outp = {}
     outp['module'] = module
     outp['prefix'] = main_prefix
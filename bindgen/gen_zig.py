@@ -8,6 +8,7 @@
 #-------------------------------------------------------------------------------
 import gen_ir
 import json, re, os, shutil
+from functools import lru_cache
 
 module_names = {
     'sg_':      'gfx',
@@ -74,50 +75,47 @@ prim_types = {
     'size_t':       'usize'
 }
 
-prim_defaults = {
-    'int':          '0',
-    'bool':         'false',
-    'int8_t':       '0',
-    'uint8_t':      '0',
-    'int16_t':      '0',
-    'uint16_t':     '0',
-    'int32_t':      '0',
-    'uint32_t':     '0',
-    'int64_t':      '0',
-    'uint64_t':     '0',
-    'float':        '0.0',
-    'double':       '0.0',
-    'uintptr_t':    '0',
-    'intptr_t':     '0',
-    'size_t':       '0'
-}
+float_types = frozenset(('float', 'double'))
 
-struct_types = []
-enum_types = []
+struct_types = set()
+enum_types = set()
 enum_items = {}
-out_lines = ''
+const_struct_ptr_types = set()
+out_file = None
 
 def reset_globals():
     global struct_types
     global enum_types
     global enum_items
-    global out_lines
-    struct_types = []
-    enum_types = []
+    global const_struct_ptr_types
+    struct_types = set()
+    enum_types = set()
     enum_items = {}
-    out_lines = ''
+    const_struct_ptr_types = set()
+    # these resolve types against the current module's struct and enum types
+    as_extern_c_arg_type.cache_clear()
+    funcptr_args_c.cache_clear()
+    classify_field_type.cache_clear()
 
 re_1d_array = re.compile("^(?:const )?\w*\s\*?\[\d*\]$")
 re_2d_array = re.compile("^(?:const )?\w*\s\*?\[\d*\]\[\d*\]$")
+match_1d_array = re_1d_array.match
+match_2d_array = re_2d_array.match
+find_array_nums = re.compile(r"\[(\d+)\]").findall
+
+# exact pointer type strings, checked by set lookup instead of
+# formatting and comparing a string for each known type
+prim_ptr_types = frozenset(f"{t} *" for t in prim_types)
+const_prim_ptr_types = frozenset(f"const {t} *" for t in prim_types)
 
 def l(s):
-    global out_lines
-    out_lines += s + '\n'
+    out_file.write(s + '\n')
 
 def as_zig_prim_type(s):
     return prim_types[s]
 
 # prefix_bla_blub(_t) => (dep.)BlaBlub
+@lru_cache(maxsize=None)
 def as_zig_struct_type(s, prefix):
     parts = s.lower().split('_')
     outp = '' if s.startswith(prefix) else f'{parts[0]}.'
@@ -127,6 +125,7 @@ def as_zig_struct_type(s, prefix):
     return outp
 
 # prefix_bla_blub(_t) => (dep.)BlaBlub
+@lru_cache(maxsize=None)
 def as_zig_enum_type(s, prefix):
     parts = s.lower().split('_')
     outp = '' if s.startswith(prefix) else f'{parts[0]}.'
@@ -152,6 +151,7 @@ def check_name_ignore(name):
     return name in name_ignores
 
 # PREFIX_BLA_BLUB to bla_blub
+@lru_cache(maxsize=None)
 def as_snake_case(s, prefix):
     outp = s.lower()
     if outp.startswith(prefix):
@@ -159,6 +159,7 @@ def as_snake_case(s, prefix):
     return outp
 
 # prefix_bla_blub => blaBlub
+@lru_cache(maxsize=None)
 def as_camel_case(s):
     parts = s.lower().split('_')[1:]
     outp = parts[0]
@@ -167,18 +168,17 @@ def as_camel_case(s):
     return outp
 
 # PREFIX_ENUM_BLA => Bla, _PREFIX_ENUM_BLA => Bla
+@lru_cache(maxsize=None)
 def as_enum_item_name(s):
-    outp = s
-    if outp.startswith('_'):
-        outp = outp[1:]
-    parts = outp.split('_')[2:]
-    outp = '_'.join(parts)
+    outp = s[1:] if s.startswith('_') else s
+    # slice off everything up to and including the second '_'
+    outp = outp[outp.index('_', outp.index('_') + 1) + 1:]
     if outp[0].isdigit():
         outp = '_' + outp
     return outp
 
 def enum_default_item(enum_name):
-    return enum_items[enum_name][0]
+    return enum_items[enum_name][0][0]
 
 def is_prim_type(s):
     return s in prim_types
@@ -199,41 +199,41 @@ def is_void_ptr(s):
     return s == "void *"
 
 def is_const_prim_ptr(s):
-    for prim_type in prim_types:
-        if s == f"const {prim_type} *":
-            return True
-    return False
+    return s in const_prim_ptr_types
 
 def is_prim_ptr(s):
-    for prim_type in prim_types:
-        if s == f"{prim_type} *":
-            return True
-    return False
+    return s in prim_ptr_types
 
 def is_const_struct_ptr(s):
-    for struct_type in struct_types:
-        if s == f"const {struct_type} *":
-            return True
-    return False
+    return s in const_struct_ptr_types
 
 def is_func_ptr(s):
     return '(*)' in s
 
 def is_1d_array_type(s):
-    return re_1d_array.match(s)
+    return match_1d_array(s)
 
 def is_2d_array_type(s):
-    return re_2d_array.match(s)
+    return match_2d_array(s)
 
+# default value of a primitive type
 def type_default_value(s):
-    return prim_defaults[s]
+    if s in float_types:
+        return '0.0'
+    elif s == 'bool':
+        return 'false'
+    else:
+        return '0'
 
+@lru_cache(maxsize=None)
 def extract_array_type(s):
     return s[:s.index('[')].strip()
 
+@lru_cache(maxsize=None)
 def extract_array_nums(s):
-    return s[s.index('['):].replace('[', ' ').replace(']', ' ').split()
+    return tuple(find_array_nums(s))
 
+@lru_cache(maxsize=None)
 def extract_ptr_type(s):
     tokens = s.split()
     if tokens[0] == 'const':
@@ -241,6 +241,8 @@ def extract_ptr_type(s):
     else:
         return tokens[0]
 
+# NOTE: cached per module, see reset_globals()
+@lru_cache(maxsize=None)
 def as_extern_c_arg_type(arg_type, prefix):
     if arg_type == "void":
         return "void"
@@ -296,8 +298,13 @@ def as_zig_arg_type(arg_prefix, arg_type, prefix):
         return arg_prefix + "??? (as_zig_arg_type)"
 
 # get C-style arguments of a function pointer as string
+# NOTE: cached per module, see reset_globals()
+@lru_cache(maxsize=None)
 def funcptr_args_c(field_type, prefix):
-    tokens = field_type[field_type.index('(*)')+4:-1].split(',')
+    args = field_type[field_type.index('(*)')+4:-1].strip()
+    if args == 'void':
+        return ""
+    tokens = args.split(',')
     s = ""
     for token in tokens:
         arg_type = token.strip()
@@ -311,6 +318,7 @@ def funcptr_args_c(field_type, prefix):
     return s
 
 # get C-style result of a function pointer as string
+@lru_cache(maxsize=None)
 def funcptr_res_c(field_type):
     res_type = field_type[:field_type.index('(*)')].strip()
     if res_type == 'void':
@@ -357,89 +365,104 @@ def funcdecl_result_zig(decl, prefix):
         zig_res_type = "void"
     return zig_res_type
 
+# classify a (C) struct field type into a tuple of (kind, args...),
+# the args are passed on to the matching entry in struct_field_emitters
+# NOTE: cached per module so that each distinct field type is only
+# resolved once, see reset_globals()
+@lru_cache(maxsize=None)
+def classify_field_type(field_type, prefix):
+    if is_prim_type(field_type):
+        return ('prim', as_zig_prim_type(field_type), type_default_value(field_type))
+    elif is_struct_type(field_type):
+        return ('struct', as_zig_struct_type(field_type, prefix))
+    elif is_enum_type(field_type):
+        return ('enum', as_zig_enum_type(field_type, prefix), enum_default_item(field_type))
+    elif is_string_ptr(field_type):
+        return ('string_ptr',)
+    elif is_const_void_ptr(field_type):
+        return ('const_void_ptr',)
+    elif is_void_ptr(field_type):
+        return ('void_ptr',)
+    elif is_const_prim_ptr(field_type):
+        return ('const_prim_ptr', as_zig_prim_type(extract_ptr_type(field_type)))
+    elif is_func_ptr(field_type):
+        return ('func_ptr', funcptr_args_c(field_type, prefix), funcptr_res_c(field_type))
+    elif is_1d_array_type(field_type):
+        array_type = extract_array_type(field_type)
+        array_nums = extract_array_nums(field_type)
+        if is_prim_type(array_type):
+            return ('array_1d', array_nums[0], as_zig_prim_type(array_type), type_default_value(array_type))
+        elif is_struct_type(array_type):
+            return ('array_1d', array_nums[0], as_zig_struct_type(array_type, prefix), '.{}')
+        elif is_const_void_ptr(array_type):
+            return ('array_1d_const_void_ptr', array_nums[0])
+        else:
+            return ('array_1d_unknown', field_type, array_type, array_nums[0])
+    elif is_2d_array_type(field_type):
+        array_type = extract_array_type(field_type)
+        array_nums = extract_array_nums(field_type)
+        if is_prim_type(array_type):
+            return ('array_2d', array_nums[0], array_nums[1], as_zig_prim_type(array_type), type_default_value(array_type))
+        elif is_struct_type(array_type):
+            return ('array_2d', array_nums[0], array_nums[1], as_zig_struct_type(array_type, prefix), '.{ }')
+        else:
+            return ('array_2d', array_nums[0], array_nums[1], '???', '???')
+    else:
+        return ('unknown', field_type)
+
+# struct field kind => function returning the Zig field declaration line
+struct_field_emitters = {
+    'prim':             lambda name, zig_type, def_val: f"    {name}: {zig_type} = {def_val},",
+    'struct':           lambda name, zig_type: f"    {name}: {zig_type} = .{{ }},",
+    'enum':             lambda name, zig_type, def_item: f"    {name}: {zig_type} = .{def_item},",
+    'string_ptr':       lambda name: f"    {name}: [*c]const u8 = null,",
+    'const_void_ptr':   lambda name: f"    {name}: ?*const c_void = null,",
+    'void_ptr':         lambda name: f"    {name}: ?*c_void = null,",
+    'const_prim_ptr':   lambda name, zig_type: f"    {name}: ?[*]const {zig_type} = null,",
+    'func_ptr':         lambda name, args, res: f"    {name}: ?fn({args}) callconv(.C) {res} = null,",
+    'func_ptr_no_callconv': lambda name, args, res: f"    {name}: ?fn({args}) {res} = null,",
+    'array_1d':         lambda name, n, zig_type, def_val: f"    {name}: [{n}]{zig_type} = [_]{zig_type}{{{def_val}}} ** {n},",
+    'array_1d_const_void_ptr': lambda name, n: f"    {name}: [{n}]?*const c_void = [_]?*const c_void {{ null }} ** {n},",
+    'array_1d_unknown': lambda name, field_type, array_type, n: f"//    FIXME: ??? array {name}: {field_type} => {array_type} [{n}]",
+    'array_2d':         lambda name, n0, n1, zig_type, def_val: f"    {name}: [{n0}][{n1}]{zig_type} = [_][{n1}]{zig_type}{{[_]{zig_type}{{ {def_val} }}**{n1}}}**{n0},",
+    'unknown':          lambda name, field_type: f"// FIXME: {name}: {field_type};",
+}
+
 def gen_struct(decl, prefix, callconvc_funcptrs = True, use_raw_name=False, use_extern=True):
     struct_name = decl['name']
     zig_type = struct_name if use_raw_name else as_zig_struct_type(struct_name, prefix)
-    l(f"pub const {zig_type} = {'extern ' if use_extern else ''}struct {{")
-    for field in decl['fields']:
-        field_name = field['name']
-        field_type = field['type']
-        field_type = check_type_override(struct_name, field_name, field_type)
-        if is_prim_type(field_type):
-            l(f"    {field_name}: {as_zig_prim_type(field_type)} = {type_default_value(field_type)},")
-        elif is_struct_type(field_type):
-            l(f"    {field_name}: {as_zig_struct_type(field_type, prefix)} = .{{ }},")
-        elif is_enum_type(field_type):
-            l(f"    {field_name}: {as_zig_enum_type(field_type, prefix)} = .{enum_default_item(field_type)},")
-        elif is_string_ptr(field_type):
-            l(f"    {field_name}: [*c]const u8 = null,")
-        elif is_const_void_ptr(field_type):
-            l(f"    {field_name}: ?*const c_void = null,")
-        elif is_void_ptr(field_type):
-            l(f"    {field_name}: ?*c_void = null,")
-        elif is_const_prim_ptr(field_type):
-            l(f"    {field_name}: ?[*]const {as_zig_prim_type(extract_ptr_type(field_type))} = null,")
-        elif is_func_ptr(field_type):
-            if callconvc_funcptrs:
-                l(f"    {field_name}: ?fn({funcptr_args_c(field_type, prefix)}) callconv(.C) {funcptr_res_c(field_type)} = null,")
-            else:
-                l(f"    {field_name}: ?fn({funcptr_args_c(field_type, prefix)}) {funcptr_res_c(field_type)} = null,")
-        elif is_1d_array_type(field_type):
-            array_type = extract_array_type(field_type)
-            array_nums = extract_array_nums(field_type)
-            if is_prim_type(array_type) or is_struct_type(array_type):
-                if is_prim_type(array_type):
-                    zig_type = as_zig_prim_type(array_type)
-                    def_val = type_default_value(array_type)
-                elif is_struct_type(array_type):
-                    zig_type = as_zig_struct_type(array_type, prefix)
-                    def_val = '.{}'
-                elif is_enum_type(array_type):
-                    zig_type = as_zig_enum_type(array_type, prefix)
-                    def_val = '.{}'
-                else:
-                    zig_type = '??? (array type)'
-                    def_val = '???'
-                t0 = f"[{array_nums[0]}]{zig_type}"
-                t0_slice = f"[]const {zig_type}"
-                t1 = f"[_]{zig_type}"
-                l(f"    {field_name}: {t0} = {t1}{{{def_val}}} ** {array_nums[0]},")
-            elif is_const_void_ptr(array_type):
-                l(f"    {field_name}: [{array_nums[0]}]?*const c_void = [_]?*const c_void {{ null }} ** {array_nums[0]},")
-            else:
-                l(f"//    FIXME: ??? array {field_name}: {field_type} => {array_type} [{array_nums[0]}]")
-        elif is_2d_array_type(field_type):
-            array_type = extract_array_type(field_type)
-            array_nums = extract_array_nums(field_type)
-            if is_prim_type(array_type):
-                zig_type = as_zig_prim_type(array_type)
-                def_val = type_default_value(array_type)
-            elif is_struct_type(array_type):
-                zig_type = as_zig_struct_type(array_type, prefix)
-                def_val = ".{ }"
-            else:
-                zig_type = "???"
-                def_val = "???"
-            t0 = f"[{array_nums[0]}][{array_nums[1]}]{zig_type}"
-            l(f"    {field_name}: {t0} = [_][{array_nums[1]}]{zig_type}{{[_]{zig_type}{{ {def_val} }}**{array_nums[1]}}}**{array_nums[0]},")
-        else:
-            l(f"// FIXME: {field_name}: {field_type};")
-    l("};")
+    func_ptr_kind = 'func_ptr' if callconvc_funcptrs else 'func_ptr_no_callconv'
+    # collect the whole struct declaration and emit it with a single l()
+    lines = [f"pub const {zig_type} = {'extern ' if use_extern else ''}struct {{"]
+    # hoist globals and bound methods used in the per-field loop into locals
+    append = lines.append
+    emitters = struct_field_emitters
+    for field_name, kind, *args in decl['fields_ir']:
+        if kind == 'func_ptr':
+            kind = func_ptr_kind
+        append(emitters[kind](field_name, *args))
+    lines.append("};")
+    l('\n'.join(lines))
 
 def gen_consts(decl, prefix):
+    lines = []
+    append = lines.append
     for item in decl['items']:
-        l(f"pub const {as_snake_case(item['name'], prefix)} = {item['value']};")
+        append(f"pub const {as_snake_case(item['name'], prefix)} = {item['value']};")
+    if lines:
+        l('\n'.join(lines))
 
 def gen_enum(decl, prefix):
-    l(f"pub const {as_zig_enum_type(decl['name'], prefix)} = enum(i32) {{")
-    for item in decl['items']:
-        item_name = as_enum_item_name(item['name'])
+    lines = [f"pub const {as_zig_enum_type(decl['name'], prefix)} = enum(i32) {{"]
+    append = lines.append
+    for item_name, item in enum_items[decl['name']]:
         if item_name != "FORCE_U32":
             if 'value' in item:
-                l(f"    {item_name} = {item['value']},")
+                append(f"    {item_name} = {item['value']},")
             else:
-                l(f"    {item_name},")
-    l("};")
+                append(f"    {item_name},")
+    lines.append("};")
+    l('\n'.join(lines))
 
 def gen_func_c(decl, prefix):
     l(f"pub extern fn {decl['name']}({funcdecl_args_c(decl, prefix)}) {funcdecl_result_c(decl, prefix)};")
@@ -474,13 +497,24 @@ def pre_parse(inp):
     for decl in inp['decls']:
         kind = decl['kind']
         if kind == 'struct':
-            struct_types.append(decl['name'])
+            struct_types.add(decl['name'])
+            const_struct_ptr_types.add(f"const {decl['name']} *")
         elif kind == 'enum':
             enum_name = decl['name']
-            enum_types.append(enum_name)
-            enum_items[enum_name] = []
-            for item in decl['items']:
-                enum_items[enum_name].append(as_enum_item_name(item['name']))
+            enum_types.add(enum_name)
+            # keep the converted item names next to the original items
+            # so that gen_enum() doesn't need to convert them again
+            enum_items[enum_name] = [(as_enum_item_name(item['name']), item) for item in decl['items']]
+    # classify the fields of all structs once all types are known,
+    # gen_struct() only emits the classified fields
+    prefix = inp['prefix']
+    for decl in inp['decls']:
+        if decl['kind'] == 'struct':
+            struct_name = decl['name']
+            decl['fields_ir'] = [
+                (field['name'], *classify_field_type(check_type_override(struct_name, field['name'], field['type']), prefix))
+                for field in decl['fields']
+            ]
 
 def gen_imports(inp, dep_prefixes):
     for dep_prefix in dep_prefixes:
@@ -488,52 +522,60 @@ def gen_imports(inp, dep_prefixes):
         l(f'const {dep_prefix[:-1]} = @import("{dep_module_name}.zig");')
         l('')
 
+# emitted for modules with a Range struct
+helper_as_range = """\
+// helper function to convert "anything" to a Range struct
+pub fn asRange(val: anytype) Range {
+    const type_info = @typeInfo(@TypeOf(val));
+    switch (type_info) {
+        .Pointer => {
+            switch (type_info.Pointer.size) {
+                .One => return .{ .ptr = val, .size = @sizeOf(type_info.Pointer.child) },
+                .Slice => return .{ .ptr = val.ptr, .size = @sizeOf(type_info.Pointer.child) * val.len },
+                else => @compileError("FIXME: Pointer type!"),
+            }
+        },
+        .Struct, .Array => {
+            return .{ .ptr = &val, .size = @sizeOf(@TypeOf(val)) };
+        },
+        else => {
+            @compileError("Cannot convert to range!");
+        }
+    }
+}
+"""
+
+# emitted for sokol_debugtext
+helper_sdtx_writer = """\
+// std.fmt compatible Writer
+pub const Writer = struct {
+    pub const Error = error { };
+    pub fn writeAll(self: Writer, bytes: []const u8) Error!void {
+        _ = self;
+        for (bytes) |byte| {
+            putc(byte);
+        }
+    }
+    pub fn writeByteNTimes(self: Writer, byte: u8, n: u64) Error!void {
+        _ = self;
+        var i: u64 = 0;
+        while (i < n): (i += 1) {
+            putc(byte);
+        }
+    }
+};
+// std.fmt-style formatted print
+pub fn print(comptime fmt: anytype, args: anytype) void {
+    var writer: Writer = .{};
+    @import("std").fmt.format(writer, fmt, args) catch {};
+}
+"""
+
 def gen_helpers(inp):
     if inp['prefix'] in ['sg_', 'sdtx_', 'sshape_']:
-        l('// helper function to convert "anything" to a Range struct')
-        l('pub fn asRange(val: anytype) Range {')
-        l('    const type_info = @typeInfo(@TypeOf(val));')
-        l('    switch (type_info) {')
-        l('        .Pointer => {')
-        l('            switch (type_info.Pointer.size) {')
-        l('                .One => return .{ .ptr = val, .size = @sizeOf(type_info.Pointer.child) },')
-        l('                .Slice => return .{ .ptr = val.ptr, .size = @sizeOf(type_info.Pointer.child) * val.len },')
-        l('                else => @compileError("FIXME: Pointer type!"),')
-        l('            }')
-        l('        },')
-        l('        .Struct, .Array => {')
-        l('            return .{ .ptr = &val, .size = @sizeOf(@TypeOf(val)) };')
-        l('        },')
-        l('        else => {')
-        l('            @compileError("Cannot convert to range!");')
-        l('        }')
-        l('    }')
-        l('}')
-        l('')
+        l(helper_as_range)
     if inp['prefix'] == 'sdtx_':
-        l('// std.fmt compatible Writer')
-        l('pub const Writer = struct {')
-        l('    pub const Error = error { };')
-        l('    pub fn writeAll(self: Writer, bytes: []const u8) Error!void {')
-        l('        _ = self;')
-        l('        for (bytes) |byte| {')
-        l('            putc(byte);')
-        l('        }')
-        l('    }')
-        l('    pub fn writeByteNTimes(self: Writer, byte: u8, n: u64) Error!void {')
-        l('        _ = self;')
-        l('        var i: u64 = 0;')
-        l('        while (i < n): (i += 1) {')
-        l('            putc(byte);')
-        l('        }')
-        l('    }')
-        l('};')
-        l('// std.fmt-style formatted print')
-        l('pub fn print(comptime fmt: anytype, args: anytype) void {')
-        l('    var writer: Writer = .{};')
-        l('    @import("std").fmt.format(writer, fmt, args) catch {};')
-        l('}')
-        l('')
+        l(helper_sdtx_writer)
 
 def gen_module(inp, dep_prefixes):
     l('// machine generated, do not edit')
@@ -564,13 +606,23 @@ def prepare():
         os.makedirs('sokol-zig/src/sokol/c')
 
 def gen(c_header_path, c_prefix, dep_c_prefixes):
+    global out_file
     module_name = module_names[c_prefix]
     c_source_path = c_source_paths[c_prefix]
     print(f'  {c_header_path} => {module_name}')
     reset_globals()
     shutil.copyfile(c_header_path, f'sokol-zig/src/sokol/c/{os.path.basename(c_header_path)}')
     ir = gen_ir.gen(c_header_path, c_source_path, module_name, c_prefix, dep_c_prefixes)
-    gen_module(ir, dep_c_prefixes)
     output_path = f"sokol-zig/src/sokol/{ir['module']}.zig"
-    with open(output_path, 'w', newline='\n') as f_outp:
-        f_outp.write(out_lines)
+    # output lines are written straight to a temporary file while generating,
+    # which only replaces the previous output file if generation succeeds
+    tmp_path = f"{output_path}.tmp"
+    try:
+        with open(tmp_path, 'w', newline='\n') as f_outp:
+            out_file = f_outp
+            gen_module(ir, dep_c_prefixes)
+        os.replace(tmp_path, output_path)
+    finally:
+        out_file = None
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)